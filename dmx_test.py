@@ -8,6 +8,33 @@ import serial
 import time
 import sys
 
+def _sleep_until_next_frame(next_time, interval):
+    """Sleep until the next absolute deadline and return it
+    
+    A late frame restarts the schedule from now rather than bursting.
+    """
+    next_time += interval
+    delay = next_time - time.perf_counter()
+    if delay > 0:
+        time.sleep(delay)
+        return next_time
+    return time.perf_counter()
+
+def _pattern_frame(values):
+    """Build a DMX frame (start code + 512 channels) with the first channels set"""
+    frame = bytearray(513)  # index 0 is the 0x00 start code
+    frame[1:1 + len(values)] = bytes(values)
+    return bytes(frame)
+
+# Pattern test frames, built once at import
+PATTERNS = (
+    ('Red', _pattern_frame([255, 0, 0, 0])),
+    ('Green', _pattern_frame([0, 255, 0, 0])),
+    ('Blue', _pattern_frame([0, 0, 255, 0])),
+    ('White', _pattern_frame([255, 255, 255, 0])),
+    ('Off', _pattern_frame([0, 0, 0, 0])),
+)
+
 def test_basic_port_access():
     """Test basic port access without closing operations"""
     print("=== Basic Port Access Test ===")
@@ -39,9 +66,9 @@ def test_basic_port_access():
         print("✗ Some ports failed")
         return False
 
-def test_dmx_basic_output():
-    """Test basic DMX output without baud rate manipulation"""
-    print("\n=== Basic DMX Output Test ===")
+def open_dmx_port():
+    """Open the DMX port once for all output tests; returns None on failure"""
+    print("\n=== DMX Port Setup ===")
     
     try:
         # Open DMX port with standard settings
@@ -52,86 +79,72 @@ def test_dmx_basic_output():
             parity=serial.PARITY_NONE,
             stopbits=2,
             timeout=0.01,
-            write_timeout=0.01
+            write_timeout=0.05  # > one frame on the wire (~23 ms)
         )
         
         print("✓ DMX port opened successfully")
         print("  Port: /dev/ttySC0")
         print("  Baud: 250000")
         print("  Config: 8N2")
+        return dmx_port
         
-        # Create test DMX frame
+    except Exception as e:
+        print(f"✗ DMX port open failed: {e}")
+        return None
+
+def test_dmx_basic_output(dmx_port):
+    """Test basic DMX output without baud rate manipulation"""
+    print("\n=== Basic DMX Output Test ===")
+    
+    try:
+        # Create test DMX frame: index 0 is already 0x00 (DMX start code)
         test_frame = bytearray(513)  # Start code + 512 channels
-        test_frame[0] = 0x00  # DMX start code
         
-        # Set some test channels
-        test_frame[1] = 255   # Channel 1: Full brightness
-        test_frame[2] = 128   # Channel 2: Half brightness  
-        test_frame[3] = 64    # Channel 3: Quarter brightness
-        test_frame[4] = 32    # Channel 4: Low brightness
-        test_frame[5] = 255   # Channel 5: Full brightness
-        test_frame[6] = 0     # Channel 6: Off
-        test_frame[7] = 255   # Channel 7: Full brightness
-        test_frame[8] = 0     # Channel 8: Off
+        # Set some test channels: full, half, quarter, low, full, off, full, off
+        test_channels = bytes([255, 128, 64, 32, 255, 0, 255, 0])
+        test_frame[1:1 + len(test_channels)] = test_channels
         
         print("\nSending DMX test frames...")
         
-        # Send multiple frames
+        # Send multiple frames at 25 FPS against absolute deadlines, so the
+        # write time does not add to the 40 ms period. Results are printed
+        # after the loop to keep stdout writes out of the frame timing.
+        next_time = time.perf_counter()
+        log = []
         for frame_num in range(5):
             try:
+                # No flush(): tcdrain() blocks ~23 ms per frame and can hang
+                # on the SC16IS752 driver; the tty buffer back-pressures instead
                 bytes_written = dmx_port.write(test_frame)
-                dmx_port.flush()
-                print(f"  Frame {frame_num + 1}: {bytes_written} bytes sent")
-                time.sleep(0.04)  # 25 FPS refresh rate
+                log.append(f"  Frame {frame_num + 1}: {bytes_written} bytes sent")
+                next_time = _sleep_until_next_frame(next_time, 0.04)
                 
             except Exception as e:
-                print(f"  Frame {frame_num + 1}: Failed - {e}")
+                log.append(f"  Frame {frame_num + 1}: Failed - {e}")
                 break
+        print("\n".join(log))
         
         print("✓ DMX output test completed")
-        
-        # Let garbage collector handle cleanup
-        del dmx_port
         return True
         
     except Exception as e:
         print(f"✗ DMX output test failed: {e}")
         return False
 
-def test_pattern_output():
+def test_pattern_output(dmx_port):
     """Send a recognizable pattern for testing with DMX devices"""
     print("\n=== Pattern Output Test ===")
     
     try:
-        dmx_port = serial.Serial('/dev/ttySC0', 250000, 8, 'N', 2, timeout=0.01)
-        print("✓ DMX port ready for pattern test")
-        
-        # Create different patterns
-        patterns = [
-            [255, 0, 0, 0],      # Red only
-            [0, 255, 0, 0],      # Green only  
-            [0, 0, 255, 0],      # Blue only
-            [255, 255, 255, 0],  # White
-            [0, 0, 0, 0]         # All off
-        ]
-        
-        for i, pattern in enumerate(patterns):
-            frame = bytearray(513)
-            frame[0] = 0x00  # Start code
-            
-            # Apply pattern to first 4 channels
-            for ch, value in enumerate(pattern):
-                frame[ch + 1] = value
-            
+        next_time = time.perf_counter()
+        for i, (pattern_name, frame) in enumerate(PATTERNS):
             dmx_port.write(frame)
-            dmx_port.flush()
             
-            pattern_name = ['Red', 'Green', 'Blue', 'White', 'Off'][i]
             print(f"  Pattern {i + 1}: {pattern_name} - sent")
-            time.sleep(1.0)  # Hold each pattern for 1 second
+            # Hold each pattern for 1 second
+            next_time = _sleep_until_next_frame(next_time, 1.0)
         
         print("✓ Pattern test completed")
-        del dmx_port
         return True
         
     except Exception as e:
@@ -143,10 +156,15 @@ def check_system_info():
     print("\n=== System Information ===")
     
     try:
-        # Check if user is in dialout group
-        import subprocess
-        result = subprocess.run(['groups'], capture_output=True, text=True)
-        groups = result.stdout.strip()
+        # Check if user is in dialout group (in-process, no `groups` fork)
+        import grp
+        import os
+        groups = set()
+        for gid in set(os.getgroups()) | {os.getegid()}:
+            try:
+                groups.add(grp.getgrgid(gid).gr_name)
+            except KeyError:
+                pass  # gid without a group entry
         
         if 'dialout' in groups:
             print("✓ User is in dialout group")
@@ -188,15 +206,16 @@ def main():
         print("4. Try reboot if driver issues persist")
         return
     
-    # DMX output test
-    if test_dmx_basic_output():
+    # DMX output tests share one port
+    dmx_port = open_dmx_port()
+    if dmx_port is not None and test_dmx_basic_output(dmx_port):
         print("\n🎉 SUCCESS: Basic DMX output working!")
         
         # Ask for pattern test
         try:
             response = input("\nRun pattern test? (y/N): ").strip().lower()
             if response in ['y', 'yes']:
-                test_pattern_output()
+                test_pattern_output(dmx_port)
         except KeyboardInterrupt:
             print("\nTest interrupted by user")
         except:
@@ -208,6 +227,9 @@ def main():
         print("2. Terminal resistors if at end of DMX line")
         print("3. Physical DMX connections")
     
+    # Let garbage collector handle cleanup
+    del dmx_port
+    
     print("\n" + "=" * 50)
     print("Test completed!")
     print("\nNext steps:")
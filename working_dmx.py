@@ -7,12 +7,117 @@ Avoids flush() and explicit close() operations that cause hanging
 import serial
 import time
 import atexit
+import array
+import asyncio
+import fcntl
+import os
+import queue
+import select
+import termios
+import threading
+
+# Break ioctls; termios may not export them, so fall back to Linux's values
+TIOCSBRK = getattr(termios, 'TIOCSBRK', 0x5427)
+TIOCCBRK = getattr(termios, 'TIOCCBRK', 0x5428)
+TIOCSERGETLSR = getattr(termios, 'TIOCSERGETLSR', 0x5459)
+TIOCSER_TEMT = getattr(termios, 'TIOCSER_TEMT', 0x01)
+
+# DMX timing: break >= 88us, then mark-after-break (MAB) >= 12us
+BREAK_NS = 100_000
+MAB_NS = 12_000
+
+# Seconds per byte on the wire at 250 kbaud 8N2 (start + 8 data + 2 stop bits)
+BYTE_TIME = 11 / 250000
+
+# Bytes can reach the wire after write() returns (kernel worker, SPI transfer,
+# 64-byte UART FIFO): how long to poll for an empty transmitter past the
+# estimate, and the extra wait used when the driver cannot report it
+DRAIN_TIMEOUT = 0.01
+DRAIN_MARGIN = 64 * BYTE_TIME + 0.001
+
+START_CODE = b'\x00'
+
+# Zero-filled source for clearing the unused tail of the frame buffer
+_ZEROS = memoryview(bytes(512))
+
+def _busy_wait_ns(ns):
+    """Spin for ns nanoseconds; time.sleep() overshoots sub-100us waits"""
+    deadline = time.perf_counter_ns() + ns
+    while time.perf_counter_ns() < deadline:
+        pass
+
+def _sleep_until_next_frame(next_time, interval):
+    """Sleep until the next absolute frame deadline and return it
+    
+    Build and write time come out of the interval instead of adding to it.
+    A late frame restarts the schedule from now rather than bursting; the
+    next send_break() still waits for the late frame to leave the UART.
+    """
+    next_time += interval
+    delay = next_time - time.perf_counter()
+    if delay > 0:
+        time.sleep(delay)
+        return next_time
+    return time.perf_counter()
+
+def _clamp_pack(intensities, out):
+    """Clamp up to 512 intensities to 0-255 into out[1:]; returns the count"""
+    n = min(len(intensities), 512)
+    for i in range(n):
+        v = intensities[i]
+        if v < 0:
+            v = 0
+        elif v > 255:
+            v = 255
+        out[i + 1] = int(v)
+    return n
+
+# numba-compiled _clamp_pack, or False if numba is missing or failed. Loaded
+# on first use because importing numba takes seconds on a Raspberry Pi.
+_clamp_pack_jit = None
+
+def _load_clamp_pack_jit():
+    """Compile _clamp_pack with numba once; returns None if that is not possible"""
+    global _clamp_pack_jit
+    if _clamp_pack_jit is None:
+        try:
+            import numpy as np
+            from numba import njit
+        except ImportError:
+            _clamp_pack_jit = False
+            return None
+        try:
+            kernel = njit(cache=True)(_clamp_pack)
+            # Compile for the argument types used per frame right away
+            kernel(np.zeros(1, dtype=np.float32), np.zeros(513, dtype=np.uint8))
+        except Exception as e:
+            # Fall back to the Python loop rather than retrying every frame
+            print(f"numba compile failed, using Python packing: {e}")
+            kernel = False
+        _clamp_pack_jit = kernel
+    return _clamp_pack_jit or None
 
 class WorkingDMXController:
-    def __init__(self, port='/dev/ttySC0'):
+    def __init__(self, port='/dev/ttySC0', strict_dmx=True):
         self.port = port
+        # False: stop each frame after the highest non-zero channel instead
+        # of always sending 512 (the receivers must accept short frames)
+        self.strict_dmx = strict_dmx
         self.dmx_port = None
+        self._fd = None
+        self._writer = None  # asyncio StreamWriter, set by open_async()
+        self._queue = None  # frames for the output thread
+        self._thread = None
         self.frame_count = 0
+        # perf_counter() time by which the last written frame has left the UART
+        self._frame_end_time = 0.0
+        self._lsr_supported = True  # False once TIOCSERGETLSR fails
+        # Persistent DMX frame: start code + 512 channels, reused every frame
+        self._frame = bytearray(513)
+        self._mv = memoryview(self._frame)
+        # uint8 numpy view of the same buffer, created for the numba kernel
+        self._frame_np = None
+        self._frame_len = 0  # highest channel that may be non-zero
         
     def open(self):
         """Open DMX port with minimal settings"""
@@ -24,30 +129,325 @@ class WorkingDMXController:
                 parity=serial.PARITY_NONE,
                 stopbits=2,
                 timeout=0.01,
-                write_timeout=0.01
+                write_timeout=0.05  # > one frame on the wire (~23 ms)
             )
+            self._fd = self.dmx_port.fileno()
+            self._set_low_latency()
             print(f"DMX port {self.port} opened successfully")
             return True
         except Exception as e:
             print(f"Failed to open {self.port}: {e}")
             return False
     
+    def _set_low_latency(self):
+        """Set ASYNC_LOW_LATENCY on the tty so small writes are not held back"""
+        try:
+            # TIOCGSERIAL/TIOCSSERIAL; on USB adapters this also drops the
+            # FTDI latency timer to its minimum
+            self.dmx_port.set_low_latency_mode(True)
+        except (AttributeError, ValueError) as e:
+            # Not Linux, or the driver does not support the flag
+            print(f"Low latency mode not available on {self.port}: {e}")
+    
+    def _pack(self, channels):
+        """Copy channel values (0-255) into the persistent frame buffer
+        
+        Buffers of unsigned bytes (bytes, bytearray, numpy uint8 arrays)
+        are copied straight from memory; other values must already be
+        clamped to 0-255.
+        """
+        if isinstance(channels, (list, tuple)):
+            data = bytes(channels[:512])
+        else:
+            data = memoryview(channels)[:512]
+            if data.format != 'B':
+                data = bytes(data.tolist())  # wider items, e.g. int32 arrays
+        
+        n = len(data)
+        self._mv[1:1 + n] = data
+        self._set_frame_len(n)
+    
+    def _pack_intensities(self, intensities):
+        """Clamp and pack per-channel intensities into the frame buffer"""
+        kernel = _load_clamp_pack_jit()
+        if kernel is not None:
+            import numpy as np
+            if self._frame_np is None:
+                self._frame_np = np.frombuffer(self._frame, dtype=np.uint8)
+            # The compiled kernel needs arrays; float32 keeps one specialization
+            n = kernel(np.asarray(intensities, dtype=np.float32), self._frame_np)
+        else:
+            n = _clamp_pack(intensities, self._frame)
+        self._set_frame_len(n)
+    
+    def _set_frame_len(self, n):
+        """Record that n channels were packed, zeroing any left past them"""
+        # Only channels set by the previous frame can be non-zero past n
+        if n < self._frame_len:
+            self._mv[1 + n:1 + self._frame_len] = _ZEROS[:self._frame_len - n]
+        if not self.strict_dmx:
+            # Short frames end at the highest non-zero channel, so callers
+            # may pass a full 512-channel list with trailing zeros
+            n = max(0, len(self._frame.rstrip(b'\0')) - 1)
+        self._frame_len = n
+    
+    def _current_frame(self):
+        """Frame to send: all 513 bytes, or up to the highest non-zero channel"""
+        if self.strict_dmx:
+            return self._mv
+        return self._mv[:1 + self._frame_len]
+    
+    def set_channel(self, channel, value):
+        """Set one channel (1-512) in the frame buffer without sending it"""
+        if not 1 <= channel <= 512:
+            raise ValueError(f"DMX channel out of range: {channel}")
+        self._frame[channel] = value
+        if channel > self._frame_len:
+            self._frame_len = channel
+    
+    def clear_channels(self):
+        """Zero the frame buffer's used channels in place without sending it"""
+        self._mv[1:1 + self._frame_len] = _ZEROS[:self._frame_len]
+        self._frame_len = 0
+    
+    def _write(self, *buffers):
+        """Write buffers straight to the port's fd with one writev() call"""
+        views = [memoryview(b) for b in buffers]
+        total = 0
+        try:
+            while views:
+                try:
+                    written = os.writev(self._fd, views)
+                except BlockingIOError:
+                    # pyserial opens the port non-blocking; wait for tty buffer space
+                    _, ready, _ = select.select([], [self._fd], [], self.dmx_port.write_timeout)
+                    if not ready:
+                        raise serial.SerialTimeoutException('Write timeout')
+                    continue
+                total += written
+                # Drop what was written; a partial write can stop mid-buffer
+                while views and written >= len(views[0]):
+                    written -= len(views.pop(0))
+                if written:
+                    views[0] = views[0][written:]
+        finally:
+            # Also after a timeout: the next break must wait for a partial frame
+            if total:
+                self._frame_written(total)
+    
+    def _frame_drain_delay(self):
+        """Seconds until the last written frame has fully left the UART"""
+        return self._frame_end_time - time.perf_counter()
+    
+    def _frame_written(self, nbytes):
+        """Record a frame write; its bytes may all still be queued for the UART"""
+        self._frame_end_time = time.perf_counter() + nbytes * BYTE_TIME
+    
+    def _wait_tx_empty(self):
+        """Wait until the UART transmitter is empty, up to DRAIN_TIMEOUT"""
+        if self._lsr_supported:
+            deadline = time.perf_counter() + DRAIN_TIMEOUT
+            lsr = array.array('I', [0])
+            try:
+                while True:
+                    fcntl.ioctl(self._fd, TIOCSERGETLSR, lsr)
+                    if lsr[0] & TIOCSER_TEMT or time.perf_counter() >= deadline:
+                        return
+                    time.sleep(BYTE_TIME)
+            except OSError:
+                self._lsr_supported = False
+        time.sleep(DRAIN_MARGIN)
+    
+    def send_break(self):
+        """Send break + MAB using TIOCSBRK/TIOCCBRK"""
+        # TIOCSBRK acts at once without draining pending output, so wait
+        # until the previous frame is out or its tail would be cut off
+        if self._frame_end_time:
+            delay = self._frame_drain_delay()
+            if delay > 0:
+                time.sleep(delay)
+            self._wait_tx_empty()
+        # serial.send_break() maps to tcsendbreak(), which on Linux holds the
+        # break for 0.25-0.5s regardless of the requested duration. The ioctls
+        # are issued directly rather than through serial.break_condition.
+        fcntl.ioctl(self._fd, TIOCSBRK)
+        _busy_wait_ns(BREAK_NS)
+        fcntl.ioctl(self._fd, TIOCCBRK)
+        _busy_wait_ns(MAB_NS)
+    
+    def _send_frame(self, *buffers):
+        """Break, then start code + channels in a single write (no flush!)"""
+        self.send_break()
+        self._write(*buffers)
+        self.frame_count += 1
+    
     def send_dmx_frame_simple(self, channels):
         """Send DMX frame without flush or close"""
         if not self.dmx_port:
             return False
             
         try:
-            # Create DMX frame: start code + 512 channels
-            frame = bytearray(513)
-            frame[0] = 0x00  # DMX start code
+            self._pack(channels)
+            self._send_frame(self._current_frame())
+            return True
+            
+        except Exception as e:
+            print(f"Frame send error: {e}")
+            return False
+    
+    def warm_up(self):
+        """Import numba and compile send_intensities()'s kernel ahead of time
+        
+        Optional: otherwise this happens in the first send_intensities()
+        call and stalls that frame. Returns True if the kernel is compiled.
+        """
+        return _load_clamp_pack_jit() is not None
+    
+    def send_intensities(self, intensities):
+        """Send DMX frame from intensities (any numbers, clamped to 0-255)
+        
+        Meant for effect code (fades, chases) producing float levels; the
+        clamp/convert loop is compiled with numba when it is installed.
+        """
+        if not self.dmx_port:
+            return False
             
-            # Copy channel data
-            for i, value in enumerate(channels[:512]):
-                frame[i + 1] = int(value) & 0xFF
+        try:
+            self._pack_intensities(intensities)
+            self._send_frame(self._current_frame())
+            return True
             
-            # Send frame (no flush!)
-            self.dmx_port.write(frame)
+        except Exception as e:
+            print(f"Frame send error: {e}")
+            return False
+    
+    def send_current_frame(self):
+        """Send the frame buffer as left by set_channel() and earlier frames"""
+        if not self.dmx_port:
+            return False
+            
+        try:
+            self._send_frame(self._current_frame())
+            return True
+            
+        except Exception as e:
+            print(f"Frame send error: {e}")
+            return False
+    
+    def send_frames(self, channels, count, interval=0.04):
+        """Send the same DMX frame count times, packing it only once
+        
+        Frames are not concatenated into one write: each needs its own
+        break, so they stay separate writes paced by interval.
+        Returns the number of frames sent.
+        """
+        if not self.dmx_port:
+            return 0
+            
+        sent = 0
+        try:
+            self._pack(channels)
+            next_time = time.perf_counter()
+            for _ in range(count):
+                self._send_frame(self._current_frame())
+                sent += 1
+                next_time = _sleep_until_next_frame(next_time, interval)
+                
+        except Exception as e:
+            print(f"Frame send error: {e}")
+        return sent
+    
+    def start_output_thread(self, interval=0.04):
+        """Send queued frames from a background thread, one per interval
+        
+        The caller builds the next frame while the previous one is on the
+        wire; os.write() and the pacing sleep release the GIL.
+        """
+        self._queue = queue.Queue(maxsize=2)
+        self._thread = threading.Thread(
+            target=self._output_loop, args=(interval,), daemon=True
+        )
+        self._thread.start()
+    
+    def queue_dmx_frame(self, channels):
+        """Pack channels and hand the frame to the output thread"""
+        if not self.dmx_port or self._thread is None:
+            return False
+            
+        self._pack(channels)
+        # Copy the channels only: the next _pack() reuses the buffer while
+        # this one waits, and the start code is gathered in by writev()
+        self._queue.put(bytes(self._current_frame()[1:]))
+        return True
+    
+    def stop_output_thread(self):
+        """Send the frames already queued, then stop the output thread"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._queue = None
+    
+    def _output_loop(self, interval):
+        next_time = None
+        while True:
+            frame = self._queue.get()  # channel data without start code
+            if frame is None:
+                return
+            
+            # Absolute deadlines avoid drift; a first, late or post-idle frame
+            # restarts the schedule from now instead of bursting to catch up.
+            # _send_frame() also waits for the previous frame to leave the UART.
+            now = time.perf_counter()
+            if next_time is None or now > next_time:
+                next_time = now
+            else:
+                time.sleep(next_time - now)
+            try:
+                self._send_frame(START_CODE, frame)
+            except Exception as e:
+                print(f"Frame send error: {e}")
+            next_time += interval
+    
+    async def open_async(self):
+        """Open DMX port as an asyncio stream (requires pyserial-asyncio)"""
+        try:
+            import serial_asyncio
+            _, self._writer = await serial_asyncio.open_serial_connection(
+                url=self.port,
+                baudrate=250000,  # DMX standard
+                bytesize=8,
+                parity=serial.PARITY_NONE,
+                stopbits=2
+            )
+            # Breaks still go through the underlying port's ioctls
+            self.dmx_port = self._writer.transport.serial
+            self._fd = self.dmx_port.fileno()
+            self._set_low_latency()
+            print(f"DMX port {self.port} opened successfully (asyncio)")
+            return True
+        except Exception as e:
+            print(f"Failed to open {self.port}: {e}")
+            return False
+    
+    async def send_dmx_frame_async(self, channels):
+        """Send DMX frame through the asyncio writer, yielding while it drains"""
+        if not self._writer:
+            return False
+            
+        try:
+            self._pack(channels)
+            # Yield while the previous frame drains instead of in send_break()
+            delay = self._frame_drain_delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.send_break()
+            # Copy: the transport may buffer the frame past the next _pack()
+            frame = bytes(self._current_frame())
+            self._writer.write(frame)
+            await self._writer.drain()
+            self._frame_written(len(frame))
             self.frame_count += 1
             return True
             
@@ -55,6 +455,32 @@ class WorkingDMXController:
             print(f"Frame send error: {e}")
             return False
     
+    async def test_pattern_async(self):
+        """Test with simple pattern, paced on the event loop clock"""
+        if not await self.open_async():
+            return False
+            
+        print("Sending test pattern...")
+        
+        channels = [255, 128, 64, 32, 16, 8, 4, 2] + [0] * 504
+        loop = asyncio.get_running_loop()
+        next_time = loop.time()
+        
+        for i in range(10):
+            if not await self.send_dmx_frame_async(channels):
+                print(f"Frame {i+1}: failed")
+                break
+            # Subtract build/write time from the 25 FPS frame period
+            next_time += 0.04
+            delay = next_time - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                next_time = loop.time()  # late: restart rather than burst
+            
+        print(f"Test completed. Sent {self.frame_count} frames total.")
+        return True
+    
     def test_pattern(self):
         """Test with simple pattern"""
         if not self.open():
@@ -66,13 +492,8 @@ class WorkingDMXController:
             # Simple test pattern
             channels = [255, 128, 64, 32, 16, 8, 4, 2] + [0] * 504
             
-            for i in range(10):
-                if self.send_dmx_frame_simple(channels):
-                    print(f"Frame {i+1}: sent")
-                else:
-                    print(f"Frame {i+1}: failed")
-                    break
-                time.sleep(0.04)  # 25 FPS
+            sent = self.send_frames(channels, 10, interval=0.04)  # 25 FPS
+            print(f"Frames sent: {sent}/10")
                 
             print(f"Test completed. Sent {self.frame_count} frames total.")
             